@@ -1,30 +1,94 @@
-import glob
+import functools
+import os
 import re
 import subprocess
 import sys
 from argparse import ArgumentParser
+from dataclasses import dataclass
 from pathlib import Path
 
 import semver
 
+# anchored to line start so version strings inside dependency tables are left alone
+_PYPROJECT_VERSION_RE = re.compile(r"^version\s*=\s*\"\d+.*?\"", re.MULTILINE)
 
-def git_check_tagged() -> bool:
-    try:
-        got = subprocess.check_output(["git", "describe", "--tags"], text=True).strip()
-        return not "-" in got
-    except subprocess.CalledProcessError:
-        return False
 
+@functools.lru_cache(maxsize=32)
+def _run_git(*args: str) -> str | None:
+    """Run a read-only git query, memoized for the lifetime of the process."""
+    got = subprocess.run(
+        ["git", *args], capture_output=True, text=True, encoding="utf-8", check=False
+    )
+    return got.stdout.strip() if got.returncode == 0 else None
+
+
+def _status_is_clean(status_output: str) -> bool:
+    """Check worktree cleanliness from `git status --porcelain=v2 -z` output.
+
+    Mirrors `git diff --quiet`: only unstaged changes to tracked files count,
+    untracked/ignored entries and staged-only changes do not.
+    """
+    entries = iter(status_output.split("\0"))
+    for entry in entries:
+        if not entry or entry.startswith("# "):
+            continue
+        if entry.startswith(("1 ", "2 ")):
+            # XY field: X is the staged status, Y is the worktree status
+            if entry[3] != ".":
+                return False
+            if entry.startswith("2 "):
+                # rename/copy entries carry the origin path as a separate token
+                next(entries, None)
+        elif entry.startswith("u "):
+            return False
+    return True
+
+
+@dataclass(frozen=True)
+class GitState:
+    """Snapshot of the git preflight queries, captured once per run."""
+
+    tracked: frozenset[str]
+    clean: bool
+    head_tags: tuple[str, ...]
+    latest_tag: str | None
+
+    @classmethod
+    def capture(cls) -> "GitState":
+        ls_files = subprocess.run(
+            ["git", "ls-files", "-z"],
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            check=False,
+        )
+        tracked = frozenset(p for p in ls_files.stdout.split("\0") if p)
+
+        status = subprocess.run(
+            ["git", "status", "--porcelain=v2", "--branch", "-z"],
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            check=False,
+        )
 
-def git_find_tag():
-    try:
-        return (
-            subprocess.check_output(["git", "describe", "--tags", "--abbrev=0"])
-            .strip()
-            .decode("utf-8")
+        head_tags = _run_git(
+            "for-each-ref",
+            "--points-at=HEAD",
+            "--format=%(refname:short)",
+            "refs/tags",
         )
-    except subprocess.CalledProcessError:
-        return None
+
+        return cls(
+            tracked=tracked,
+            clean=_status_is_clean(status.stdout),
+            head_tags=tuple(head_tags.splitlines()) if head_tags else (),
+            latest_tag=_run_git("describe", "--tags", "--abbrev=0"),
+        )
+
+
+def git_check_tagged(state: GitState) -> bool:
+    return bool(state.head_tags)
 
 
 def parse_version(tag: str) -> tuple[semver.VersionInfo, str]:
@@ -36,40 +100,82 @@ def parse_version(tag: str) -> tuple[semver.VersionInfo, str]:
     return semver.VersionInfo.parse(tag, optional_minor_and_patch=True), prefix
 
 
-def is_working_directory_clean():
-    try:
-        subprocess.check_output(["git", "diff", "--quiet"])
-        return True
-    except subprocess.CalledProcessError:
-        return False
+def is_path_tracked_by_git(state: GitState, file: str) -> bool:
+    return str(file) in state.tracked
 
 
-def is_path_tracked_by_git(file: str):
-    try:
-        subprocess.check_output(
-            ["git", "ls-files", "--error-unmatch", file], stderr=subprocess.DEVNULL
-        )
-        return True
-    except subprocess.CalledProcessError:
-        return False
+_SKIP_DIRS = {"node_modules", "__pycache__", "dist", "build"}
 
 
-def collect_file_updates(new_version: str):
-    updates = {}
-    version_files = Path().glob("**/version.txt")
-    updates.update(
-        {f: new_version for f in version_files if is_path_tracked_by_git(f.parent)}
-    )
+def _find_version_files(root: str = "."):
+    """Walk the tree for version.txt files, pruning hidden and vendored dirs.
 
-    toml = Path("pyproject.toml")
-    if toml.exists():
-        cont = toml.read_text()
-        new_cont = re.sub(
-            r"version\s*=\s*\"\d+.*?\"", f'version = "{new_version}"', cont
+    Fallback for repositories with no tracked files yet (e.g. before the
+    initial commit), where the ls-files snapshot is empty.
+    """
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in _SKIP_DIRS or entry.name.startswith("."):
+                        continue
+                    stack.append(entry.path)
+                elif entry.name == "version.txt":
+                    yield os.path.relpath(entry.path, root)
+
+
+def _compute_pyproject(new_version: str) -> str | None:
+    cont = Path("pyproject.toml").read_text()
+    target = f'version = "{new_version}"'
+    # one search pass covers the idempotent rerun case without subn's reallocation
+    already = _PYPROJECT_VERSION_RE.search(cont)
+    if already and already.group(0) == target:
+        print("pyproject.toml already up to date, skipping")
+        return None
+    new_cont, count = _PYPROJECT_VERSION_RE.subn(target, cont)
+    if not count:
+        print("No version line found in pyproject.toml, not updating it")
+        return None
+    return new_cont
+
+
+def iter_file_updates(state: GitState, new_version: str):
+    """Yield (path, tracked, provider) for each file that may need updating.
+
+    The provider computes the new content lazily, so nothing is read or
+    rewritten before the user has confirmed the bump.
+    """
+    # the tracked-file snapshot replaces a recursive fs walk, which would
+    # also descend into node_modules/, .venv/ and friends
+    if state.tracked:
+        version_files = [
+            f
+            for f in sorted(state.tracked)
+            if f == "version.txt" or f.endswith("/version.txt")
+        ]
+    else:
+        version_files = sorted(_find_version_files())
+    for f in version_files:
+        yield f, is_path_tracked_by_git(state, f), lambda v=new_version: v
+
+    if Path("pyproject.toml").exists():
+        yield (
+            "pyproject.toml",
+            is_path_tracked_by_git(state, "pyproject.toml"),
+            functools.partial(_compute_pyproject, new_version),
         )
-        if new_cont != cont:
-            updates["pyproject.toml"] = new_cont
-    return updates
+
+
+def _atomic_write(path: Path, data: str) -> None:
+    """Write via a temp file and rename, so a crash can't leave a truncated file."""
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(data)
+    os.replace(tmp, path)
 
 
 def get_version():
@@ -119,16 +225,18 @@ def main():
         print("fistbump " + get_version())
         return
 
+    state = GitState.capture()
+
     if args.check:
-        if not is_working_directory_clean():
+        if not state.clean:
             print("Working directory is not clean, commit changes before proceeding")
             sys.exit(2)
-        if not git_check_tagged():
+        if not git_check_tagged(state):
             print("Current version is not tagged, need to run 'fistbump' first")
             sys.exit(2)
         return 0
 
-    current_tag = git_find_tag()
+    current_tag = state.latest_tag
     if current_tag is None:
         print("No tags found")
         return
@@ -152,6 +260,10 @@ def main():
         )
         return None
 
+    if new_version == parsed_version:
+        print(f"Already at version {new_version}, nothing to do")
+        return
+
     new_version_tag = f"{prefix}{new_version}"
     print(f"New version: {new_version}")
     if str(new_version) != new_version_tag:
@@ -168,7 +280,7 @@ def main():
             ran_commands.append(" ".join(map(str, cmd)))
         subprocess.run(cmd, check=True)
 
-    if not is_working_directory_clean():
+    if not state.clean:
         run_command(["git", "status", "-s"])
         if args.pre:
             print("Working directory is not clean, but proceeding because of --pre")
@@ -178,11 +290,10 @@ def main():
             )
             return
 
-    updates = collect_file_updates(str(new_version))
-    for file, content in updates.items():
-        print(f"######### File: {file}")
-        print(content)
-        print()
+    updates = list(iter_file_updates(state, str(new_version)))
+    print("Files to update:")
+    for file, _tracked, _provider in updates:
+        print(f"  {file}")
     prompt = (
         "Proceed with changes and tagging? [y/N] "
         if not args.pre
@@ -192,21 +303,22 @@ def main():
     if not ok:
         print("Aborted by user request")
         return
-    commit_needed = False
-    for file, content in updates.items():
+    to_stage = []
+    for file, tracked, provider in updates:
+        content = provider()
+        if content is None:
+            # the provider already explained why there is nothing to write
+            continue
         print(f"Updating {file}")
         if not args.dry:
-            Path(file).write_text(content)
-            if is_path_tracked_by_git(file) and not args.pre:
-                print("git add", file)
-                run_command(
-                    ["git", "add", file],
-                )
-                commit_needed = True
+            _atomic_write(Path(file), content)
+            if tracked and not args.pre:
+                to_stage.append(str(file))
             else:
                 print(f"File {file} is not tracked by git, skipping add")
 
-    if commit_needed:
+    if to_stage:
+        run_command(["git", "add", "--", *to_stage])
         run_command(
             ["git", "commit", "-m", f"Bump version to {new_version}"], check_dry=True
         )